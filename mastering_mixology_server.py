@@ -0,0 +1,339 @@
+import asyncio
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from mastering_mixology_simulation import (
+    ESTIMATORS,
+    all_draws,
+    legal_choices,
+    load_draw_choices_from_csv,
+    run_baseline_simulation,
+)
+
+# === Setup ===
+
+MAX_UPLOAD_BYTES = 1024 * 1024
+DEFAULT_RUNS = 100000
+
+REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+
+# === Strategy Handling ===
+
+def normalize_strategy(text):
+    # Parse an uploaded strategy and return it in a canonical form, so the same
+    # strategy always hashes the same regardless of row order or choice order
+    draw_to_choice = {}
+    reader = csv.DictReader(io.StringIO(text))
+    if reader.fieldnames is None or not {"draw", "choice"} <= set(reader.fieldnames):
+        raise ValueError("Strategy must have a 'draw,choice' header")
+    for row in reader:
+        if not row["draw"]:
+            continue
+        draw = tuple(sorted(row["draw"].strip().split("-")))
+        choice = tuple(sorted((row["choice"] or "").strip().split("-")))
+        if choice not in legal_choices(draw):
+            raise ValueError(f"Invalid choice '{row['choice']}' for draw: {row['draw']}")
+        draw_to_choice[draw] = choice
+
+    missing = [draw for draw in all_draws() if draw not in draw_to_choice]
+    if missing:
+        raise ValueError(f"No potion selection provided for draw: {'-'.join(missing[0])}")
+
+    lines = ["draw,choice"]
+    for draw in all_draws():
+        lines.append(f"{'-'.join(draw)},{'-'.join(draw_to_choice[draw])}")
+    return "\n".join(lines) + "\n"
+
+def job_id_for(strategy_text, runs, estimator):
+    return hashlib.sha256(f"runs={runs}\nestimator={estimator}\n{strategy_text}".encode()).hexdigest()
+
+def run_job(strategy_path, runs, estimator, output_dir, job_id, progress_queue):
+    # Runs inside a worker process; progress is reported back through the queue
+    draw_to_choice_map = load_draw_choices_from_csv(strategy_path)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        run_baseline_simulation(
+            draw_to_choice_map,
+            strategy_path,
+            runs=runs,
+            output_dir=output_dir,
+            estimator=estimator,
+            progress_callback=lambda pct: progress_queue.put((job_id, pct)),
+        )
+
+
+# === Job Server ===
+
+class Job:
+    def __init__(self, id, runs, estimator, output_dir):
+        self.id = id
+        self.runs = runs
+        self.estimator = estimator
+        self.output_dir = output_dir
+        self.status = "queued"
+        self.progress = 0.0
+        self.error = None
+        self.changed = asyncio.Condition()
+
+    @property
+    def summary_path(self):
+        return os.path.join(self.output_dir, "summary.csv")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "runs": self.runs,
+            "estimator": self.estimator,
+            "status": self.status,
+            "progress": round(self.progress, 2),
+            "error": self.error,
+        }
+
+    async def update(self, **fields):
+        async with self.changed:
+            for key, value in fields.items():
+                setattr(self, key, value)
+            self.changed.notify_all()
+
+
+class JobServer:
+    def __init__(self, store_dir, workers):
+        self.store_dir = store_dir
+        self.jobs = {}
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.manager = multiprocessing.Manager()
+        self.progress_queue = self.manager.Queue()
+        self.progress_task = None
+
+    async def start(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.progress_task = asyncio.create_task(self.forward_progress())
+
+    async def close(self):
+        self.progress_queue.put(None)
+        if self.progress_task is not None:
+            await self.progress_task
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.manager.shutdown()
+
+    async def forward_progress(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self.progress_queue.get)
+            if item is None:
+                return
+            job_id, pct = item
+            job = self.jobs.get(job_id)
+            if job is not None and job.status in ("queued", "running"):
+                await job.update(status="running", progress=pct)
+
+    def get_job(self, job_id):
+        # Jobs finished by an earlier server instance are served from the store
+        if job_id not in self.jobs:
+            output_dir = os.path.join(self.store_dir, job_id)
+            if len(job_id) != 64 or not os.path.exists(os.path.join(output_dir, "summary.csv")):
+                return None
+            job = Job(job_id, None, None, output_dir)
+            job.status = "done"
+            job.progress = 100.0
+            self.jobs[job_id] = job
+        return self.jobs[job_id]
+
+    def submit(self, strategy_text, runs, estimator):
+        strategy_text = normalize_strategy(strategy_text)
+        job_id = job_id_for(strategy_text, runs, estimator)
+        job = self.get_job(job_id)
+        if job is not None and job.status != "failed":
+            if job.runs is None:
+                job.runs, job.estimator = runs, estimator
+            return job, True
+
+        output_dir = os.path.join(self.store_dir, job_id)
+        os.makedirs(output_dir, exist_ok=True)
+        strategy_path = os.path.join(output_dir, "strategy.csv")
+        with open(strategy_path, "w", newline="") as csvfile:
+            csvfile.write(strategy_text)
+
+        job = Job(job_id, runs, estimator, output_dir)
+        self.jobs[job_id] = job
+        asyncio.create_task(self.execute(job, strategy_path))
+        return job, False
+
+    async def execute(self, job, strategy_path):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self.pool, run_job, strategy_path, job.runs, job.estimator, job.output_dir, job.id, self.progress_queue
+            )
+        except Exception as e:
+            await job.update(status="failed", error=str(e))
+        else:
+            await job.update(status="done", progress=100.0)
+
+    # === HTTP Handling ===
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            if not request_line:
+                return
+            method, target_path, _ = request_line.split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if length > MAX_UPLOAD_BYTES:
+                await self.respond(writer, 413, {"error": "Strategy file too large"})
+                return
+            body = await reader.readexactly(length) if length else b""
+            await self.route(writer, method, target_path, body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            await self.respond(writer, 400, {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            with contextlib.suppress(ConnectionError):
+                writer.close()
+                await writer.wait_closed()
+
+    async def route(self, writer, method, target_path, body):
+        url = urlsplit(target_path)
+        parts = [p for p in url.path.split("/") if p]
+
+        if parts == ["jobs"]:
+            if method != "POST":
+                await self.respond(writer, 405, {"error": "Use POST to submit a strategy"})
+                return
+            query = parse_qs(url.query)
+            runs = int(query.get("runs", [DEFAULT_RUNS])[0])
+            if runs < 1:
+                raise ValueError("runs must be at least 1")
+            estimator = query.get("estimator", ["plain"])[0]
+            if estimator not in ESTIMATORS:
+                raise ValueError(f"Unknown estimator: {estimator}")
+            job, cached = self.submit(body.decode("utf-8-sig"), runs, estimator)
+            await self.respond(writer, 200 if job.status == "done" else 202, {**job.to_dict(), "cached": cached})
+            return
+
+        if len(parts) < 2 or parts[0] != "jobs" or method != "GET":
+            await self.respond(writer, 404, {"error": "Not found"})
+            return
+        job = self.get_job(parts[1])
+        if job is None:
+            await self.respond(writer, 404, {"error": f"Unknown job: {parts[1]}"})
+        elif parts[2:] == []:
+            await self.respond(writer, 200, job.to_dict())
+        elif parts[2:] == ["summary.csv"]:
+            if job.status == "done":
+                with open(job.summary_path, newline="") as csvfile:
+                    await self.respond(writer, 200, csvfile.read(), content_type="text/csv")
+            else:
+                await self.respond(writer, 202, job.to_dict())
+        elif parts[2:] == ["stream"]:
+            await self.stream(writer, job)
+        else:
+            await self.respond(writer, 404, {"error": "Not found"})
+
+    async def stream(self, writer, job):
+        # Chunked plain-text stream: one progress line per update, then summary.csv
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; charset=utf-8\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+
+        async def send(text):
+            data = text.encode()
+            writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+
+        last_progress = None
+        while True:
+            async with job.changed:
+                if job.status not in ("done", "failed") and job.progress == last_progress:
+                    await job.changed.wait()
+                status, progress = job.status, job.progress
+            if progress != last_progress:
+                await send(f"Progress: {progress:.2f}%\n")
+                last_progress = progress
+            if status == "failed":
+                await send(f"Error: {job.error}\n")
+                break
+            if status == "done":
+                with open(job.summary_path, newline="") as csvfile:
+                    await send("\n" + csvfile.read())
+                break
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def respond(self, writer, code, payload, content_type="application/json"):
+        if content_type == "application/json":
+            payload = json.dumps(payload) + "\n"
+        data = payload.encode()
+        writer.write(
+            f"HTTP/1.1 {code} {REASONS[code]}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+
+
+async def serve(args):
+    server = JobServer(args.store, args.workers)
+    await server.start()
+    if args.socket:
+        listener = await asyncio.start_unix_server(server.handle, path=args.socket)
+        print(f"Serving strategy evaluations on unix socket {args.socket}")
+    else:
+        listener = await asyncio.start_server(server.handle, args.host, args.port)
+        print(f"Serving strategy evaluations on http://{args.host}:{args.port}")
+    print(f"Results stored in {args.store} ({args.workers} worker processes)")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local job server that queues Mastering Mixology strategy evaluations.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--socket", type=str, default=None, help="Listen on this unix socket path instead of TCP")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) - 1),
+        help="Maximum number of simulations running at once (default: CPU count - 1)"
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        default="server_jobs",
+        help="Directory where strategies and their results are stored, one folder per content hash (default: server_jobs)"
+    )
+    args = parser.parse_args()
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve(args))
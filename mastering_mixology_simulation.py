@@ -1,6 +1,8 @@
 import random
-from itertools import product
-from collections import defaultdict
+from itertools import product, combinations, accumulate
+from collections import defaultdict, Counter
+from bisect import bisect
+from math import factorial, sqrt
 import csv
 import argparse
 import os
@@ -31,9 +33,12 @@ potions = [
 potion_map = {p.id: p for p in potions}
 potion_ids = list(potion_map.keys())
 potion_weights = [potion_map[pid].weight for pid in potion_ids]
+cum_potion_weights = list(accumulate(potion_weights))
 
 target = {"mox": 61050, "aga": 52550, "lye": 70500}
 
+ESTIMATORS = ["plain", "antithetic", "control", "antithetic-control"]
+
 
 # === Helper Functions ===
 
@@ -43,18 +48,150 @@ def is_done(current):
 def bonus_for_count(n):
     return {1:1.0, 2:1.2, 3:1.4}[n]
 
-def run_baseline_simulation(draw_to_choice_map, runs=100000):
+def all_draws():
+    return sorted(set(tuple(sorted(draw)) for draw in product(potion_ids, repeat=3)))
+
+def draw_from_uniforms(uniforms):
+    # Same inverse-CDF lookup random.choices uses, so a plain stream of
+    # random.random() values reproduces the original draws exactly
+    total = cum_potion_weights[-1]
+    hi = len(potion_ids) - 1
+    return tuple(sorted(potion_ids[bisect(cum_potion_weights, u * total, 0, hi)] for u in uniforms))
+
+def fresh_uniforms(recorded=None):
+    while True:
+        uniforms = (random.random(), random.random(), random.random())
+        if recorded is not None:
+            recorded.append(uniforms)
+        yield uniforms
+
+def antithetic_uniforms(previous):
+    # Mirror image (1 - u) of the previous run's draws, followed by fresh
+    # draws once this run outlasts it
+    for uniforms in previous:
+        yield tuple(1.0 - u for u in uniforms)
+    yield from fresh_uniforms()
+
+def solve_linear_system(matrix, vector):
+    # Gaussian elimination with partial pivoting for the small control variate system
+    n = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        if abs(rows[col][col]) < 1e-12:
+            raise ValueError("Control variates are linearly dependent")
+        for r in range(col + 1, n):
+            factor = rows[r][col] / rows[col][col]
+            for c in range(col, n + 1):
+                rows[r][c] -= factor * rows[col][c]
+    solution = [0.0] * n
+    for r in reversed(range(n)):
+        solution[r] = (rows[r][n] - sum(rows[r][c] * solution[c] for c in range(r + 1, n))) / rows[r][r]
+    return solution
+
+def estimate_mean(totals, controls, estimator):
+    # Returns (mean, standard error) of the potions used under the chosen estimator.
+    # Antithetic runs are averaged per pair; control variates have a known mean of
+    # zero (Wald's identity), so their fitted contribution is subtracted per unit.
+    if estimator in ("antithetic", "antithetic-control"):
+        totals = [(totals[i] + totals[i + 1]) / 2 for i in range(0, len(totals), 2)]
+        controls = [
+            [(a + b) / 2 for a, b in zip(controls[i], controls[i + 1])]
+            for i in range(0, len(controls), 2)
+        ]
+    n = len(totals)
+    values = list(totals)
+
+    if estimator in ("control", "antithetic-control") and n > 1:
+        mean_y = sum(values) / n
+        k = len(controls[0])
+        means = [sum(c[j] for c in controls) / n for j in range(k)]
+        # Drop controls that never vary (e.g. always brewing full orders)
+        used = [j for j in range(k) if sum((c[j] - means[j]) ** 2 for c in controls) > 1e-9]
+        if used:
+            cov = [
+                [sum((c[a] - means[a]) * (c[b] - means[b]) for c in controls) for b in used]
+                for a in used
+            ]
+            cov_y = [sum((c[a] - means[a]) * (y - mean_y) for c, y in zip(controls, values)) for a in used]
+            beta = solve_linear_system(cov, cov_y)
+            values = [
+                y - sum(b * c[j] for b, j in zip(beta, used))
+                for y, c in zip(values, controls)
+            ]
+
+    mean = sum(values) / n
+    if n < 2:
+        return mean, float("nan")
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+    return mean, sqrt(variance / n)
+
+def draw_probability(draw):
+    # Multinomial probability of drawing this sorted combination of 3 potions
+    total_weight = sum(potion_weights)
+    prob = factorial(len(draw))
+    for pid, n in Counter(draw).items():
+        prob *= (potion_map[pid].weight / total_weight) ** n / factorial(n)
+    return prob
+
+def gain_for_choice(chosen_potions):
+    bonus = bonus_for_count(len(chosen_potions))
+    return {
+        r: sum(getattr(potion_map[pid], r) for pid in chosen_potions) * bonus
+        for r in target
+    }
+
+def legal_choices(draw):
+    # Every non-empty subset of the draw, duplicates in the draw collapsed
+    choices = set()
+    for n in range(1, len(draw) + 1):
+        for comb in combinations(draw, n):
+            choices.add(tuple(sorted(comb)))
+    return sorted(choices)
+
+def expected_rates(draw_to_choice_map):
+    # Analytic expected resource gain and potions brewed per draw
+    rates = {r: 0.0 for r in target}
+    potions_per_draw = 0.0
+    for draw in all_draws():
+        prob = draw_probability(draw)
+        chosen_potions = draw_to_choice_map[draw]
+        for r, value in gain_for_choice(chosen_potions).items():
+            rates[r] += prob * value
+        potions_per_draw += prob * len(chosen_potions)
+    return rates, potions_per_draw
+
+def run_baseline_simulation(draw_to_choice_map, strategy_file, runs=100000, output_dir=None, progress_callback=None, estimator="plain"):
+    if estimator not in ESTIMATORS:
+        raise ValueError(f"Unknown estimator: {estimator}")
+    if estimator in ("antithetic", "antithetic-control") and runs % 2:
+        # Antithetic runs come in pairs
+        runs += 1
     all_run_data = []
+    run_draws = []
     aggregate_potion_counts = defaultdict(int)
+    previous_uniforms = []
 
     for _ in range(runs):
         # Progress bar
         current = {"mox": 0, "aga": 0, "lye": 0}
         potion_counts = defaultdict(int)
         total_potions_used = 0
+        draws_used = 0
+
+        if estimator in ("antithetic", "antithetic-control"):
+            if _ % 2:
+                uniform_stream = antithetic_uniforms(previous_uniforms)
+            else:
+                previous_uniforms = []
+                uniform_stream = fresh_uniforms(previous_uniforms)
+        else:
+            uniform_stream = fresh_uniforms()
 
         while not is_done(current):
-            draw = tuple(sorted(random.choices(potion_ids, weights=potion_weights, k=3)))
+            draw = draw_from_uniforms(next(uniform_stream))
+            draws_used += 1
             chosen_potions = draw_to_choice_map.get(draw)
 
             if not chosen_potions:
@@ -79,11 +216,14 @@ def run_baseline_simulation(draw_to_choice_map, runs=100000):
             **{pid: potion_counts[pid] for pid in potion_ids}
         }
         all_run_data.append(run_record)
+        run_draws.append(draws_used)
 
         for pid in potion_ids:
             aggregate_potion_counts[pid] += potion_counts[pid]
         if _ % max(1, runs // 10) == 0:
             print(f"Progress: {(_ / runs) * 100:.2f}%")
+            if progress_callback is not None:
+                progress_callback(_ / runs * 100)
 
     # === Summary Statistics ===
     total_potions_list = [run["total_potions"] for run in all_run_data]
@@ -98,6 +238,21 @@ def run_baseline_simulation(draw_to_choice_map, runs=100000):
         return max(all_run_data, key=lambda x: x[key])
 
     avg_potions_used = sum(total_potions_list) / runs
+
+    # === Estimator Statistics ===
+    # Per run: observed minus analytic expected resources and potions for the
+    # number of draws it took
+    rates, potions_per_draw = expected_rates(draw_to_choice_map)
+    controls = [
+        [run[r] - n * rates[r] for r in target] + [run["total_potions"] - n * potions_per_draw]
+        for run, n in zip(all_run_data, run_draws)
+    ]
+    estimated_potions, std_error = estimate_mean(total_potions_list, controls, estimator)
+    plain_variance = (
+        sum((t - avg_potions_used) ** 2 for t in total_potions_list) / (runs - 1) if runs > 1 else float("nan")
+    )
+    effective_sample_size = plain_variance / std_error ** 2 if std_error > 0 else float("inf")
+    ess_gain = effective_sample_size / runs
     avg_per_potion = {pid: aggregate_potion_counts[pid] / runs for pid in potion_ids}
     avg_targets = {
         "mox": sum(mox_list) / runs,
@@ -106,12 +261,15 @@ def run_baseline_simulation(draw_to_choice_map, runs=100000):
     }
 
     # === Prepare Output Directory ===
-    strategy_basename = os.path.splitext(os.path.basename(args.strategy_file))[0]
-    output_dir = os.path.join("strategies", strategy_basename)
+    if output_dir is None:
+        strategy_basename = os.path.splitext(os.path.basename(strategy_file))[0]
+        output_dir = os.path.join("strategies", strategy_basename)
     os.makedirs(output_dir, exist_ok=True)
 
     # Copy the strategy file into the output directory
-    shutil.copy2(args.strategy_file, os.path.join(output_dir, os.path.basename(args.strategy_file)))
+    strategy_copy = os.path.join(output_dir, os.path.basename(strategy_file))
+    if os.path.abspath(strategy_copy) != os.path.abspath(strategy_file):
+        shutil.copy2(strategy_file, strategy_copy)
 
     # === Write Detailed Run Data ===
     run_data_path = os.path.join(output_dir, "run_data.csv")
@@ -135,6 +293,17 @@ def run_baseline_simulation(draw_to_choice_map, runs=100000):
         writer.writerow(["Minimum Potions Used", min(total_potions_list)])
         writer.writerow(["Maximum Potions Used", max(total_potions_list)])
 
+        writer.writerow([])
+        writer.writerow(["Estimator", "Estimated Average Potions Used", "Standard Error", "95% CI Half-Width", "Effective Sample Size", "ESS Gain"])
+        writer.writerow([
+            estimator,
+            f"{estimated_potions:.2f}",
+            f"{std_error:.4f}",
+            f"{1.96 * std_error:.4f}",
+            f"{effective_sample_size:.0f}",
+            f"{ess_gain:.2f}",
+        ])
+
         writer.writerow([])
         writer.writerow(["Potion Type", "Average", "Minimum", "Maximum"])
         for pid in potion_ids:
@@ -155,15 +324,161 @@ def run_baseline_simulation(draw_to_choice_map, runs=100000):
         print(f"Summary statistics saved to {summary_path}")
 
     # === Console Report ===
-    print(f"\n=== Simulation Summary for Strategy File: {args.strategy_file} ===")
+    print(f"\n=== Simulation Summary for Strategy File: {strategy_file} ===")
     print(f"Runs: {runs}")
     print(f"Average Potions Used to Reach Target: {avg_potions_used:.2f}")
+    print(f"Estimator ({estimator}): {estimated_potions:.2f} ± {1.96 * std_error:.2f} (95% CI)")
+    print(f"Effective Sample Size: {effective_sample_size:.0f} ({ess_gain:.2f}x the runs)")
     print("Average Potion Usage per Type:")
     for pid in potion_ids:
         print(f"  {pid}: {avg_per_potion[pid]:.2f}")
     print("Average Reached:")
     for key in ["mox", "aga", "lye"]:
         print(f"  {key.upper()}: {avg_targets[key]:.2f}")
+    return summary_path
+
+def draws_to_finish(current, rates):
+    # Fluid estimate of extra draws needed (negative: draws that could be dropped)
+    # until every resource reaches its target at the given per-draw rates
+    needed = []
+    for r in target:
+        missing = target[r] - current[r]
+        if rates[r] > 0:
+            needed.append(missing / rates[r])
+        elif missing > 0:
+            return float("inf")
+    return max(needed) if needed else 0.0
+
+def run_sensitivity_analysis(draw_to_choice_map, strategy_file, runs=10000, top=None):
+    # Replays a single shared draw stream under the current strategy and tracks
+    # how often each draw occurs per run. Switching draw d to another choice
+    # shifts that run's totals by count(d) * (new gain - old gain); the change in
+    # draws needed to (still) hit the targets is then estimated from the analytic
+    # per-draw rates, so every edit is scored without re-running the simulation.
+    rates, potions_per_draw = expected_rates(draw_to_choice_map)
+    resources = list(target)
+    draws = all_draws()
+    draw_gains = {}
+
+    edits = []
+    for draw in draws:
+        current_choice = tuple(sorted(draw_to_choice_map[draw]))
+        current_gain = gain_for_choice(current_choice)
+        draw_gains[draw] = current_gain
+        prob = draw_probability(draw)
+        for alternative in legal_choices(draw):
+            if alternative == current_choice:
+                continue
+            alt_gain = gain_for_choice(alternative)
+            delta_count = len(alternative) - len(current_choice)
+            edits.append({
+                "draw": draw,
+                "current": current_choice,
+                "alternative": alternative,
+                "probability": prob,
+                "delta_gain": [alt_gain[r] - current_gain[r] for r in resources],
+                "delta_count": delta_count,
+                "rates": {r: rates[r] + prob * (alt_gain[r] - current_gain[r]) for r in resources},
+                "potions_per_draw": potions_per_draw + prob * delta_count,
+            })
+
+    # Edits that stop producing a resource altogether can never reach the target
+    scored_edits = [edit for edit in edits if all(edit["rates"][r] > 0 for r in resources)]
+    draw_index = {draw: i for i, draw in enumerate(draws)}
+    # Flattened per-edit constants for the hot loop below
+    edit_constants = [
+        (
+            draw_index[edit["draw"]],
+            *edit["delta_gain"],
+            edit["delta_count"],
+            *(edit["potions_per_draw"] / edit["rates"][r] for r in resources),
+        )
+        for edit in scored_edits
+    ]
+
+    delta_sums = [0.0] * len(scored_edits)
+    draw_count_sums = [0] * len(draws)
+    total_potions_sum = 0
+
+    for _ in range(runs):
+        current = {"mox": 0, "aga": 0, "lye": 0}
+        draw_counts = [0] * len(draws)
+        total_potions_used = 0
+
+        while not is_done(current):
+            draw = tuple(sorted(random.choices(potion_ids, weights=potion_weights, k=3)))
+            chosen_potions = draw_to_choice_map.get(draw)
+
+            if not chosen_potions:
+                raise ValueError(f"No potion selection provided for draw: {draw}")
+
+            for r, value in draw_gains[draw].items():
+                current[r] += value
+            draw_counts[draw_index[draw]] += 1
+            total_potions_used += len(chosen_potions)
+
+        total_potions_sum += total_potions_used
+        for i, n in enumerate(draw_counts):
+            draw_count_sums[i] += n
+
+        # Subtract the same estimate for the unchanged strategy so the final
+        # draw's overshoot does not bias every edit
+        baseline_adjust = draws_to_finish(current, rates) * potions_per_draw
+        miss_mox, miss_aga, miss_lye = (target[r] - current[r] for r in resources)
+        for i, (d, dg_mox, dg_aga, dg_lye, dc, k_mox, k_aga, k_lye) in enumerate(edit_constants):
+            n = draw_counts[d]
+            delta_sums[i] += n * dc + max(
+                (miss_mox - n * dg_mox) * k_mox,
+                (miss_aga - n * dg_aga) * k_aga,
+                (miss_lye - n * dg_lye) * k_lye,
+            ) - baseline_adjust
+
+        if _ % max(1, runs // 10) == 0:
+            print(f"Progress: {(_ / runs) * 100:.2f}%")
+
+    avg_potions_used = total_potions_sum / runs
+    deltas = {id(edit): delta_sum / runs for edit, delta_sum in zip(scored_edits, delta_sums)}
+    results = []
+    for edit in edits:
+        delta = deltas.get(id(edit), float("inf"))
+        results.append({
+            "draw": "-".join(edit["draw"]),
+            "current_choice": "-".join(edit["current"]),
+            "alternative_choice": "-".join(edit["alternative"]),
+            "draw_probability": f"{edit['probability']:.6f}",
+            "average_draw_count": f"{draw_count_sums[draw_index[edit['draw']]] / runs:.2f}",
+            "delta_potions": f"{delta:.2f}",
+            "estimated_potions": f"{avg_potions_used + delta:.2f}",
+            "_delta": delta,
+        })
+    results.sort(key=lambda row: row["_delta"])
+    if top is not None:
+        results = results[:top]
+
+    # === Write Analysis ===
+    strategy_basename = os.path.splitext(os.path.basename(strategy_file))[0]
+    output_dir = os.path.join("strategies", strategy_basename)
+    os.makedirs(output_dir, exist_ok=True)
+    analysis_path = os.path.join(output_dir, "analysis.csv")
+    with open(analysis_path, "w", newline="") as csvfile:
+        fieldnames = [
+            "draw", "current_choice", "alternative_choice", "draw_probability",
+            "average_draw_count", "delta_potions", "estimated_potions",
+        ]
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        for row in results:
+            writer.writerow(row)
+        print(f"Sensitivity analysis saved to {analysis_path}")
+
+    # === Console Report ===
+    print(f"\n=== Sensitivity Analysis for Strategy File: {strategy_file} ===")
+    print(f"Runs: {runs}")
+    print(f"Average Potions Used to Reach Target: {avg_potions_used:.2f}")
+    print("Most valuable edits (change in average potions used):")
+    for row in results[:10]:
+        print(f"  {row['draw']}: {row['current_choice']} -> {row['alternative_choice']} ({row['delta_potions']})")
+    return results
 
 # === Example Usage ===
 def load_draw_choices_from_csv(filepath):
@@ -177,11 +492,10 @@ def load_draw_choices_from_csv(filepath):
     return draw_to_choice_map
 
 def generate_draw_template(filepath="draw_choices.csv"):
-    all_draws = set(tuple(sorted(draw)) for draw in product(potion_ids, repeat=3))
     with open(filepath, "w", newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["draw", "choice"])
-        for draw in sorted(all_draws):
+        for draw in all_draws():
             draw_key = "-".join(draw)
             writer.writerow([draw_key, "-".join(draw)])
 
@@ -196,13 +510,35 @@ if __name__ == "__main__":
         "number_of_runs",
         type=int,
         nargs="?",
-        default=100000,
-        help="Number of simulation runs to perform (default: 100000)"
+        default=None,
+        help="Number of simulation runs to perform (default: 100000, or 10000 with --analyze)"
+    )
+    parser.add_argument(
+        "--estimator",
+        choices=ESTIMATORS,
+        default="plain",
+        help="Monte Carlo estimator for the average potions used: antithetic draw pairs and/or control variates on the analytic expected gain per draw (default: plain)"
+    )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="Instead of a full simulation, estimate how many potions each alternative choice per draw would save and write a ranked analysis.csv"
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=None,
+        help="Only keep the N most valuable edits in analysis.csv (default: all)"
     )
     args = parser.parse_args()
+    if args.number_of_runs is None:
+        args.number_of_runs = 10000 if args.analyze else 100000
     # generate_draw_template()
     # Print number of runs
     print(f"Using strategy file: {args.strategy_file}")
     print(f"Number of runs: {args.number_of_runs}")
     draw_to_choice_map = load_draw_choices_from_csv(args.strategy_file)
-    run_baseline_simulation(draw_to_choice_map, runs=args.number_of_runs)
+    if args.analyze:
+        run_sensitivity_analysis(draw_to_choice_map, args.strategy_file, runs=args.number_of_runs, top=args.top)
+    else:
+        run_baseline_simulation(draw_to_choice_map, args.strategy_file, runs=args.number_of_runs, estimator=args.estimator)